@@ -1,18 +1,26 @@
 import os
 import re
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Tuple
 import tiktoken
 from tqdm import tqdm
 import json
 
-def estimate_tokens(text: str) -> int:
-    """Estimate the number of tokens in a text using tiktoken."""
+@lru_cache(maxsize=1)
+def _get_enc():
+    """Load the tiktoken encoder once, or None if it is unavailable."""
     try:
-        encoding = tiktoken.get_encoding("cl100k_base")
-        return len(encoding.encode(text))
+        return tiktoken.get_encoding("cl100k_base")
     except:
+        return None
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text using tiktoken."""
+    encoding = _get_enc()
+    if encoding is None:
         return len(text) // 4
+    return len(encoding.encode_ordinary(text))
 
 class PythonProjectFlattener:
     def __init__(
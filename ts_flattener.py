@@ -1,20 +1,198 @@
+import mmap
 import os
 import re
-from pathlib import Path
-from typing import List, Dict, Tuple
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+from typing import BinaryIO, List, Dict, Tuple
 import tiktoken
 from tqdm import tqdm
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
-def estimate_tokens(text: str) -> int:
-    """Estimate the number of tokens in a text using tiktoken."""
+_EXCLUDED_DIRS = frozenset({
+    'node_modules',
+    'build',
+    'dist',
+    '.next',
+    '.git',
+    '.cache'
+})
+
+_EXT_TUPLE = ('.ts', '.tsx', '.js', '.jsx', '.css', '.scss', '.json')
+
+_TEST_SUFFIXES = ('.test.ts', '.test.tsx')
+
+# Matches a path inside an excluded directory or ending in a test suffix
+_REJECT_RE = re.compile(
+    rf"(?:^|/)(?:{'|'.join(map(re.escape, sorted(_EXCLUDED_DIRS)))})(?:/|$)"
+    rf"|(?:{'|'.join(map(re.escape, _TEST_SUFFIXES))})$"
+)
+
+_PRIORITIES = (
+    ('/components/', 1),
+    ('/pages/', 2),
+    ('/features/', 3),
+    ('/utils/', 4),
+    ('/types/', 5),
+    ('/styles/', 6)
+)
+
+# Only relative imports are rewritten, so the pattern requires the path to start with '.'
+_RELATIVE_IMPORT_RE = re.compile(r'''import[^\n]*?from\s+['"](\.[^'"]*)['"]''')
+
+# Delimiters written around each file's header and after each chunk's file list
+_HASH_BAR = '#' * 80
+_TOC_END = b"\n" + b"=" * 80 + b"\n\n"
+
+# Number of files each worker process reads and tokenizes per task
+_READ_BATCH_SIZE = 256
+
+# Batches submitted ahead of the packing loop, per worker process
+_IN_FLIGHT_PER_WORKER = 2
+
+# Files estimated at more than this many times tokens_per_file are skipped unread
+_OVERSIZE_FACTOR = 4
+
+# Files larger than this are memory-mapped rather than read into a bytes object
+_MMAP_THRESHOLD = 256 * 1024
+
+# Texts longer than this are never passed to tiktoken, even in exact mode
+_EXACT_TOKENS_MAX_CHARS = 1_000_000
+
+# Stay within the usual IOV_MAX limit for a single writev call
+_WRITEV_BATCH = 1024
+
+# Buffer size used when copying a spooled chunk body into its output file
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+# Only Linux allows sendfile between regular files (same check shutil uses)
+_USE_SENDFILE = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+
+
+@lru_cache(maxsize=1)
+def _get_enc():
+    """Load the tiktoken encoder once, or None if it is unavailable."""
     try:
-        encoding = tiktoken.get_encoding("cl100k_base")
-        return len(encoding.encode(text))
+        return tiktoken.get_encoding("cl100k_base")
     except:
-        return len(text) // 4
+        return None
+
+
+def estimate_tokens(text: str, exact: bool = False) -> int:
+    """Estimate the number of tokens in a text (~4 characters per token, or tiktoken if exact)."""
+    return estimate_tokens_batch([text], exact=exact)[0]
+
+
+def estimate_tokens_batch(texts: List[str], exact: bool = False, num_threads: int = None) -> List[int]:
+    """Estimate the number of tokens in each text, using one batched tiktoken call if exact."""
+    counts = [len(text) >> 2 for text in texts]
+
+    encoding = _get_enc() if exact else None
+    if encoding is None:
+        return counts
+
+    # tiktoken can go quadratic on huge repetitive inputs (e.g. minified bundles), so those keep the heuristic
+    exact_indices = [i for i, text in enumerate(texts) if len(text) <= _EXACT_TOKENS_MAX_CHARS]
+    token_lists = encoding.encode_ordinary_batch([texts[i] for i in exact_indices],
+                                                 num_threads=num_threads or os.cpu_count() or 8)
+    for i, tokens in zip(exact_indices, token_lists):
+        counts[i] = len(tokens)
+    return counts
+
+
+def _list_dir(path: str, excluded_dirs: frozenset) -> Tuple[List[str], List[str]]:
+    """Split the entries of path into files and subdirectories worth descending into."""
+    files = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # DirEntry caches the type from readdir, so this costs no extra stat
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in excluded_dirs:
+                    subdirs.append(entry.path)
+            elif not entry.is_dir():
+                files.append(entry.path)
+    return files, subdirs
+
+
+def _scan(path: str, excluded_dirs: frozenset = frozenset()):
+    """Yield every file path under path, in the same order as os.walk.
+
+    Directories named in excluded_dirs are never descended into.
+    """
+    pending = deque([path])
+    while pending:
+        try:
+            files, subdirs = _list_dir(pending.pop(), excluded_dirs)
+        except OSError:
+            continue
+
+        yield from files
+        pending.extend(reversed(subdirs))
+
+
+def _parallel_scan(path: str, excluded_dirs: frozenset = frozenset()) -> List[str]:
+    """Like _scan, but walks each top-level subdirectory in its own thread.
+
+    scandir releases the GIL while reading directories, so subtrees are listed
+    concurrently. Results are joined in os.walk order.
+    """
+    try:
+        files, subdirs = _list_dir(path, excluded_dirs)
+    except OSError:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, len(subdirs)) or 1) as executor:
+        subtrees = executor.map(lambda subdir: list(_scan(subdir, excluded_dirs)), subdirs)
+        return files + list(chain.from_iterable(subtrees))
+
+
+def _write_all(fd: int, data: bytes):
+    """Write data to fd, retrying until os.write has taken every byte."""
+    remaining = memoryview(data)
+    while remaining:
+        remaining = remaining[os.write(fd, remaining):]
+
+
+def _write_parts(fd: int, parts: List[bytes]):
+    """Write a list of buffers to fd without concatenating them first."""
+    for start in range(0, len(parts), _WRITEV_BATCH):
+        batch = parts[start:start + _WRITEV_BATCH]
+        written = os.writev(fd, batch) if hasattr(os, 'writev') else 0
+
+        # writev may stop short (or be unavailable); finish the batch with plain writes
+        if written < sum(len(part) for part in batch):
+            _write_all(fd, memoryview(b''.join(batch))[written:])
+
+
+def _copy_body(body: BinaryIO, fd: int):
+    """Copy all of body to fd, in the kernel via sendfile where the platform supports file-to-file copies."""
+    body.flush()
+    offset = 0
+    if _USE_SENDFILE:
+        size = os.fstat(body.fileno()).st_size
+        try:
+            while offset < size:
+                sent = os.sendfile(fd, body.fileno(), offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+        except OSError:
+            pass
+
+    # Userspace copy for other platforms, or for whatever sendfile did not finish
+    body.seek(offset)
+    for block in iter(lambda: body.read(_COPY_BUFFER_SIZE), b''):
+        _write_all(fd, block)
 
 
 class ProjectFlattener:
@@ -23,83 +201,60 @@ class ProjectFlattener:
             project_path: str,
             output_dir: str = "flattened_output",
             tokens_per_file: int = 150000,
-            prioritize_paths: List[str] = None
+            prioritize_paths: List[str] = None,
+            exact_tokens: bool = False
     ):
         self.project_path = os.path.abspath(project_path)
+        # Every scanned path starts with project_path plus a separator, so slicing replaces relpath
+        self._prefix_len = len(os.path.join(self.project_path, ''))
         self.output_dir = output_dir
         self.tokens_per_file = tokens_per_file
         self.prioritize_paths = prioritize_paths or []
+        # One regex search per path replaces a Python-level any() over prioritize_paths
+        self._prioritize_re = re.compile('|'.join(map(re.escape, self.prioritize_paths))) \
+            if self.prioritize_paths else None
+        self.exact_tokens = exact_tokens
 
         print(f"🔍 Initializing flattener for: {self.project_path}")
         print(f"📂 Output directory: {output_dir}")
+        print(f"🔢 Token counting: {'exact (tiktoken)' if exact_tokens else 'approximate (~4 chars/token)'}")
         os.makedirs(output_dir, exist_ok=True)
 
     def is_relevant_file(self, file_path: str) -> bool:
         """Check if the file should be included in the flattened output."""
-        # Convert to normalized Path object for reliable path matching
-        path = Path(file_path).resolve()
-
-        # Convert both paths to strings using forward slashes for consistency
-        normalized_path = str(path).replace(os.sep, '/')
-
-        # Define excluded directories
-        excluded_dirs = [
-            'node_modules',
-            'build',
-            'dist',
-            '.next',
-            '.git',
-            '.cache'
-        ]
-
-        # Check if any excluded directory is in the path
-        if any(f'/{excluded}/' in normalized_path or normalized_path.endswith(f'/{excluded}')
-               for excluded in excluded_dirs):
-            return False
-
-        # Check file extensions
-        extensions = {'.ts', '.tsx', '.js', '.jsx', '.css', '.scss', '.json'}
-        if not any(normalized_path.endswith(ext) for ext in extensions):
-            return False
+        # Plain string normalization; resolve() would stat every path component
+        normalized_path = file_path.replace(os.sep, '/')
 
-        # Exclude test files
-        if normalized_path.endswith('.test.ts') or normalized_path.endswith('.test.tsx'):
+        # Check file extensions first; most non-source files stop here
+        if not normalized_path.endswith(_EXT_TUPLE):
             return False
 
-        return True
+        # Excluded directories and test files are rejected by one regex search
+        return _REJECT_RE.search(normalized_path) is None
 
     def get_file_priority(self, file_path: str) -> int:
         """Determine priority of a file for processing order."""
-        normalized_path = str(Path(file_path)).replace(os.sep, '/')
+        normalized_path = file_path.replace(os.sep, '/')
 
-        if any(p in normalized_path for p in self.prioritize_paths):
+        if self._prioritize_re is not None and self._prioritize_re.search(normalized_path):
             return 0
 
-        priorities = {
-            'components': 1,
-            'pages': 2,
-            'features': 3,
-            'utils': 4,
-            'types': 5,
-            'styles': 6
-        }
-
-        for key, priority in priorities.items():
-            if f'/{key}/' in normalized_path:
+        for key, priority in _PRIORITIES:
+            if key in normalized_path:
                 return priority
         return 99
 
     def process_imports(self, content: str, file_path: str) -> str:
         """Convert relative imports to flattened format."""
 
+        # Most files without imports never reach the regex engine
+        if 'from' not in content:
+            return content
+
         def replace_import(match):
-            import_path = match.group(2)
-            if import_path.startswith('.'):
-                return f"// Original import: {match.group(0)}\n// Flattened version would be: import from '{import_path}'"
-            return match.group(0)
+            return f"// Original import: {match.group(0)}\n// Flattened version would be: import from '{match.group(1)}'"
 
-        import_pattern = r'(import.*from\s+[\'"])(.[^\'"]*)([\'"])'
-        return re.sub(import_pattern, replace_import, content)
+        return _RELATIVE_IMPORT_RE.sub(replace_import, content)
 
     def flatten(self) -> Dict[str, List[str]]:
         """Flatten the project into multiple files of manageable size."""
@@ -108,13 +263,11 @@ class ProjectFlattener:
         all_files = []
         excluded_files = []
 
-        for root, _, files in os.walk(self.project_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if self.is_relevant_file(file_path):
-                    all_files.append(file_path)
-                else:
-                    excluded_files.append(file_path)
+        for file_path in _parallel_scan(self.project_path, _EXCLUDED_DIRS):
+            if self.is_relevant_file(file_path):
+                all_files.append(file_path)
+            else:
+                excluded_files.append(file_path)
 
         print(f"📊 Found {len(all_files)} relevant files")
         print(f"🚫 Excluded {len(excluded_files)} files")
@@ -122,50 +275,71 @@ class ProjectFlattener:
         # Debug output for the first few excluded files
         print("\nSample of excluded files:")
         for file in excluded_files[:5]:
-            print(f"  - {os.path.relpath(file, self.project_path)}")
+            print(f"  - {file[self._prefix_len:].replace(os.sep, '/')}")
 
         print("\n📋 Sorting files by priority...")
         all_files.sort(key=self.get_file_priority)
 
-        current_chunk = []
+        batches = [all_files[i:i + _READ_BATCH_SIZE] for i in range(0, len(all_files), _READ_BATCH_SIZE)]
+        max_workers = min(os.cpu_count() or 1, len(batches)) or 1
+
+        # Only the current chunk's paths stay in memory; contents are spooled to a temp file
+        current_paths = []
+        current_body = None
         current_token_count = 0
         chunk_number = 1
         chunks = {}
 
         print("\n⚙️ Processing files...")
-        with tqdm(total=len(all_files), desc="Processing", unit="file") as pbar:
-            for file_path in all_files:
-                rel_path = os.path.relpath(file_path, self.project_path)
-
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        processed_content = self.process_imports(content, file_path)
-                        file_content = f"\n\n{'#' * 80}\n# File: {rel_path}\n{'#' * 80}\n\n{processed_content}"
-                        file_tokens = estimate_tokens(file_content)
-
-                        if current_token_count + file_tokens > self.tokens_per_file and current_chunk:
-                            chunk_file = f"chunk_{chunk_number}.txt"
-                            self.write_chunk(chunk_file, current_chunk)
-                            chunks[chunk_file] = [f[0] for f in current_chunk]
-                            print(f"\n💾 Wrote chunk_{chunk_number}.txt ({len(current_chunk)} files)")
-                            current_chunk = []
-                            current_token_count = 0
-                            chunk_number += 1
-
-                        current_chunk.append((rel_path, file_content))
-                        current_token_count += file_tokens
-
-                except Exception as e:
-                    print(f"\n⚠️ Error processing {rel_path}: {str(e)}")
-
-                pbar.update(1)
-
-        if current_chunk:
+        # Redraw at most ~200 times, and skip the bar entirely when stderr is not a terminal
+        with tqdm(total=len(all_files), desc="Processing", unit="file",
+                  miniters=max(1, len(all_files) // 200), mininterval=0.2,
+                  disable=not sys.stderr.isatty()) as pbar, \
+                ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Keep a bounded window of batches in flight so finished results can't pile up in memory
+            # while packing catches up; results are consumed in submission order to keep priority order
+            remaining_batches = iter(batches)
+            in_flight = deque((batch, executor.submit(_read_and_tokenize, self, batch))
+                              for batch in islice(remaining_batches, _IN_FLIGHT_PER_WORKER * max_workers))
+
+            while in_flight:
+                batch, future = in_flight.popleft()
+                next_batch = next(remaining_batches, None)
+                if next_batch is not None:
+                    in_flight.append((next_batch, executor.submit(_read_and_tokenize, self, next_batch)))
+
+                rel_paths, file_contents, token_counts, errors, skipped = future.result()
+
+                for rel_path, error in errors:
+                    print(f"\n⚠️ Error processing {rel_path}: {error}")
+                for rel_path, file_size in skipped:
+                    print(f"\n⏭️ Skipped (too large) {rel_path}: {file_size} bytes is far beyond "
+                          f"{self.tokens_per_file} tokens per chunk")
+
+                for rel_path, file_content, file_tokens in zip(rel_paths, file_contents, token_counts):
+                    if current_token_count + file_tokens > self.tokens_per_file and current_paths:
+                        chunk_file = f"chunk_{chunk_number}.txt"
+                        self.write_chunk(chunk_file, current_paths, current_body)
+                        chunks[chunk_file] = current_paths
+                        print(f"\n💾 Wrote chunk_{chunk_number}.txt ({len(current_paths)} files)")
+                        current_paths = []
+                        current_body = None
+                        current_token_count = 0
+                        chunk_number += 1
+
+                    if current_body is None:
+                        current_body = tempfile.TemporaryFile()
+                    current_body.write(file_content)
+                    current_paths.append(rel_path)
+                    current_token_count += file_tokens
+
+                pbar.update(len(batch))
+
+        if current_paths:
             chunk_file = f"chunk_{chunk_number}.txt"
-            self.write_chunk(chunk_file, current_chunk)
-            chunks[chunk_file] = [f[0] for f in current_chunk]
-            print(f"\n💾 Wrote final chunk_{chunk_number}.txt ({len(current_chunk)} files)")
+            self.write_chunk(chunk_file, current_paths, current_body)
+            chunks[chunk_file] = current_paths
+            print(f"\n💾 Wrote final chunk_{chunk_number}.txt ({len(current_paths)} files)")
 
         self.create_chunk_manifest(chunks)
         print(f"\n✅ Done! Created {len(chunks)} chunks")
@@ -187,26 +361,81 @@ class ProjectFlattener:
         }
 
         manifest_path = os.path.join(self.output_dir, "manifest.json")
-        with open(manifest_path, 'w') as f:
-            json.dump(manifest, f, indent=2)
+        if orjson is not None:
+            with open(manifest_path, 'wb') as f:
+                f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+        else:
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
 
         return manifest_path
 
-    def write_chunk(self, chunk_file: str, chunk_contents: List[Tuple[str, str]]):
-        """Write a chunk of files to an output file."""
+    def write_chunk(self, chunk_file: str, rel_paths: List[str], body: BinaryIO):
+        """Write a chunk of files to an output file.
+
+        body holds the already formatted file contents and is closed once copied.
+        """
         output_path = os.path.join(self.output_dir, chunk_file)
 
-        with open(output_path, 'w', encoding='utf-8') as out:
-            out.write(f"# Chunk: {chunk_file}\n\n")
-            out.write("## Contained Files:\n")
-            for rel_path, _ in chunk_contents:
-                out.write(f"- {rel_path}\n")
+        parts = [f"# Chunk: {chunk_file}\n\n".encode('utf-8'), b"## Contained Files:\n"]
+        for rel_path in rel_paths:
+            parts.append(f"- {rel_path}\n".encode('utf-8'))
+
+        parts.append(_TOC_END)
+
+        with body, open(output_path, 'wb', buffering=0) as out:
+            _write_parts(out.fileno(), parts)
+            _copy_body(body, out.fileno())
+
+
+def _read_and_tokenize(
+        flattener: ProjectFlattener,
+        file_paths: List[str]
+) -> Tuple[List[str], List[bytes], List[int], List[Tuple[str, str]], List[Tuple[str, int]]]:
+    """Read, format and count tokens for a batch of files in a worker process.
+
+    Returns parallel lists of rel_paths, UTF-8 encoded file contents and token counts
+    for the files that could be read, (rel_path, error message) for those that could not,
+    and (rel_path, size in bytes) for files skipped unread as too large.
+    """
+    rel_paths = []
+    file_contents = []
+    errors = []
+    skipped = []
+    prefix_len = flattener._prefix_len
+
+    for file_path in file_paths:
+        rel_path = file_path[prefix_len:].replace(os.sep, '/')
+
+        try:
+            # Decode the whole file in one call rather than through a text-mode reader
+            with open(file_path, 'rb') as f:
+                # Files this far past the chunk budget are generated bundles; don't read them at all
+                file_size = os.fstat(f.fileno()).st_size
+                if file_size // 4 > flattener.tokens_per_file * _OVERSIZE_FACTOR:
+                    skipped.append((rel_path, file_size))
+                    continue
+                if file_size > _MMAP_THRESHOLD:
+                    # Decode straight from the mapped pages instead of copying them into a bytes object first
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        content = str(mapped, 'utf-8')
+                else:
+                    content = f.read().decode('utf-8')
+            # Match text-mode universal newlines so CRLF sources don't mix line endings into the chunk
+            if '\r' in content:
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
+            processed_content = flattener.process_imports(content, file_path)
+            file_contents.append(f"\n\n{_HASH_BAR}\n# File: {rel_path}\n{_HASH_BAR}\n\n{processed_content}")
+            rel_paths.append(rel_path)
 
-            out.write("\n" + "=" * 80 + "\n\n")
+        except Exception as e:
+            errors.append((rel_path, str(e)))
 
-            for _, content in chunk_contents:
-                out.write(content)
+    # The pool already spreads work across cores, so keep tiktoken single-threaded here
+    token_counts = estimate_tokens_batch(file_contents, exact=flattener.exact_tokens, num_threads=1)
 
+    # Encode here so the parent only copies bytes into the chunk body
+    return rel_paths, [file_content.encode('utf-8') for file_content in file_contents], token_counts, errors, skipped
 
 if __name__ == "__main__":
     project_path = input("Enter project path: ")
@@ -221,7 +450,8 @@ if __name__ == "__main__":
     flattener = ProjectFlattener(
         project_path=project_path,
         prioritize_paths=priorities,
-        tokens_per_file=150000
+        tokens_per_file=150000,
+        exact_tokens="--exact-tokens" in sys.argv[1:]
     )
 
     chunks = flattener.flatten()
\ No newline at end of file